@@ -10,14 +10,18 @@ from utils.formatting_utils import setup_formatter
 from cort.preprocessing import parse_and_preprocess_sentences, run_multiprocessing_job, normalize_texts
 from sklearn.model_selection import StratifiedKFold, train_test_split
 
+# Rust-backed fast tokenizers encode the batch across all cores
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'true')
+
 
 def preprocess_sentences_on_batch(batch):
-    sentences = []
-    for sentence in batch:
-        sentence = normalize_texts(sentence, remove_specials=False, remove_last_period=False)
-        sentence = sentence.lower()  # do_lower_case
-        sentences.append(sentence)
-    return sentences
+    # Normalized sentences never contain line breaks, since `normalize_texts` collapses all whitespaces.
+    # Returning a single newline-terminated string lets the result queue pickle one buffer per worker
+    # instead of one object per sentence.
+    return ''.join([
+        normalize_texts(sentence, remove_specials=False, remove_last_period=False).lower() + '\n'  # do_lower_case
+        for sentence in batch
+    ])
 
 
 def create_int_feature(values):
@@ -51,9 +55,7 @@ def create_tfrecords(args, output_dir):
     df = parse_and_preprocess_sentences(args.filepath)
     results = run_multiprocessing_job(preprocess_sentences_on_batch, df['sentences'],
                                       num_processes=args.num_processes)
-    sentences = []
-    for batch in results:
-        sentences += batch
+    sentences = ''.join(results).split('\n')[:-1]
 
     logging.info('Tokenizing examples')
     tokenizer = utils.create_tokenizer_from_config(args)
@@ -61,10 +63,11 @@ def create_tfrecords(args, output_dir):
                           padding='max_length',
                           truncation=True,
                           return_attention_mask=False,
-                          return_token_type_ids=False)
-    input_ids = np.array(tokenized['input_ids'], dtype=np.int32)
-    sections = np.array(df['code_sections'].values, dtype=np.int32)
-    labels = np.array(df['code_labels'].values, dtype=np.int32)
+                          return_token_type_ids=False,
+                          return_tensors='np')
+    input_ids = tokenized['input_ids'].astype(np.int32, copy=False)
+    sections = df['code_sections'].to_numpy(copy=False)
+    labels = df['code_labels'].to_numpy(copy=False)
 
     if args.test_size and args.test_size < 1.0:
         splits = train_test_split(input_ids, sections, labels,
@@ -82,8 +85,10 @@ def create_tfrecords(args, output_dir):
         write_examples(fname, input_ids, sections, labels)
         return
 
+    # StratifiedKFold only looks at the number of samples of X, not the tokenized inputs themselves
     fold = StratifiedKFold(n_splits=args.num_k_fold, shuffle=True, random_state=args.seed)
-    for index, (train_indices, valid_indices) in enumerate(fold.split(input_ids, labels)):
+    placeholder = np.zeros(len(labels), dtype=np.int8)
+    for index, (train_indices, valid_indices) in enumerate(fold.split(placeholder, labels)):
         fname = os.path.join(
             output_dir, 'train.fold-{}-of-{}.tfrecord'.format(index + 1, args.num_k_fold)
         )
@@ -109,8 +114,8 @@ def main():
                         help='Location of KorSci-BERT vocabulary file')
     parser.add_argument('--korscielectra_vocab', default='./cort/pretrained/korscielectra/data/vocab.txt',
                         help='Location of KorSci-ELECTRA vocabulary file')
-    parser.add_argument('--num_processes', default=4, type=int,
-                        help='Parallelize across multiple processes')
+    parser.add_argument('--num_processes', default=-1, type=int,
+                        help='Parallelize across multiple processes, -1 to use all available cores')
     parser.add_argument('--num_k_fold', default=10, type=int,
                         help='Number of K-Fold splits')
     parser.add_argument('--test_size', default=0, type=float,
@@ -38,6 +38,15 @@ class Config:
         self.batch_size = kwargs.pop('batch_size', 64)
         self.distribute = kwargs.pop('distribute', False)
 
+        # Number of examples buffered for shuffling the training dataset
+        self.shuffle_buffer_size = kwargs.pop('shuffle_buffer_size', 8192)
+
+        # Whether to cache the parsed validation dataset after the first evaluation. Only validation is cached,
+        # the training dataset is never cached, so training epochs do not get any faster from this option.
+        # Cached in memory when `dataset_cache_dir` is empty, otherwise spilled to files under the directory.
+        self.enable_dataset_cache = kwargs.pop('enable_dataset_cache', False)
+        self.dataset_cache_dir = kwargs.pop('dataset_cache_dir', '')
+
         # Total number of train steps for Pre-training.
         self.num_train_steps = kwargs.pop('num_train_steps', 10000)
 
@@ -85,6 +94,9 @@ class Config:
         self.pretraining_run_name = kwargs.pop('pretraining_run_name', '')
         self.log_freq = kwargs.pop('log_freq', 2000)
 
+        # Interval of steps to fetch training metrics from the device and report those on W&B
+        self.metric_log_freq = kwargs.pop('metric_log_freq', 50)
+
         # Model Hyperparameters
 
         # Name of Pre-trained backbone model. One of `korscibert`, `korscielectra`
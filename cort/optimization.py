@@ -94,6 +94,12 @@ def create_optimizer(config: ConfigLike, total_train_steps):
     return optimizer, learning_rate_fn
 
 
+def compute_learning_rates(learning_rate_fn, total_train_steps):
+    # Evaluates the schedule for all steps at once, so that training loops look up the rates on the host
+    steps = tf.range(total_train_steps + 1, dtype=tf.int64)
+    return learning_rate_fn(steps).numpy()
+
+
 class LinearWarmUp(optimizers.schedules.LearningRateSchedule):
 
     def __init__(self, initial_learning_rate, decay_schedule_fn, warmup_steps, power=1.0, epsilon=1e-12, name=None):
@@ -340,14 +346,18 @@ class GradientAccumulator(object):
     def accumulated_gradients(self):
         return list(gradient.value() if gradient is not None else gradient for gradient in self.get_replica_gradients())
 
-    def __call__(self, gradients):
-        """Accumulates :obj:`gradients`."""
+    def build(self, gradients):
+        """Creates the accumulated gradients shaped as :obj:`gradients` ahead of accumulating within graph loops."""
         if not self.gradients:
             self.gradients.extend([
                 tf.Variable(tf.zeros_like(gradient), trainable=False) if gradient is not None else gradient
                 for gradient in gradients
             ])
 
+    def __call__(self, gradients):
+        """Accumulates :obj:`gradients`."""
+        self.build(gradients)
+
         if len(gradients) != len(self.gradients):
             raise ValueError('Expected %s gradients, but got %d' % (len(self.gradients), len(gradients)))
 
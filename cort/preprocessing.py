@@ -32,6 +32,19 @@ SPECIAL_CHAR_REPLACEMENTS = [
     ('팔꿉', '팔꿈치'), ('뻣나무', '벚나무')
 ]
 
+
+def compile_replacement_pattern(replacements):
+    # Longer candidates first so that alternation never prefers a shorter prefix
+    candidates = sorted([before for before, _ in replacements], key=len, reverse=True)
+    return re.compile('|'.join([re.escape(candidate) for candidate in candidates]))
+
+
+# Fused patterns to replace all candidates in a single scan instead of chaining `str.replace`
+REMOVABLE_SPECIAL_CHAR_PATTERN = compile_replacement_pattern(REMOVABLE_SPECIAL_CHAR_REPLACEMENTS)
+REMOVABLE_SPECIAL_CHAR_MAP = dict(REMOVABLE_SPECIAL_CHAR_REPLACEMENTS)
+SPECIAL_CHAR_PATTERN = compile_replacement_pattern(SPECIAL_CHAR_REPLACEMENTS)
+SPECIAL_CHAR_MAP = dict(SPECIAL_CHAR_REPLACEMENTS)
+
 RESEARCH_PURPOSE = ['문제 정의', '가설 설정', '기술 정의']
 RESEARCH_METHOD = ['제안 방법', '대상 데이터', '데이터처리', '이론/모형']
 RESEARCH_RESULT = ['성능/효과', '후속연구']
@@ -63,8 +76,13 @@ def parse_and_preprocess_sentences(filepath: str) -> pd.DataFrame:
             raise ValueError('Invalid label: {}'.format(label))
 
     df = pd.DataFrame(dicts)
-    df['code_labels'] = df['labels'].apply(lambda name: LABEL_NAMES.index(name))
-    df['code_sections'] = df['sections'].apply(lambda name: SECTION_NAMES.index(name))
+
+    # Categorical columns keep a single copy of each name and its integer codes in contiguous arrays.
+    # The codes use the narrowest integer type covering the categories, e.g., int8 for less than 128 classes.
+    df['labels'] = pd.Categorical(df['labels'], categories=LABEL_NAMES)
+    df['sections'] = pd.Categorical(df['sections'], categories=SECTION_NAMES)
+    df['code_labels'] = df['labels'].cat.codes
+    df['code_sections'] = df['sections'].cat.codes
 
     def print_description(name, titles, stats):
         logging.info('{}:'.format(name))
@@ -91,10 +109,11 @@ def normalize_texts(sentence,
                     remove_spaces=True,
                     remove_last_period=True):
     if filter_specials:
-        for before, after in REMOVABLE_SPECIAL_CHAR_REPLACEMENTS:
-            sentence = sentence.replace(before, ' ' if remove_specials else after)
-        for before, after in SPECIAL_CHAR_REPLACEMENTS:
-            sentence = sentence.replace(before, after)
+        if remove_specials:
+            sentence = REMOVABLE_SPECIAL_CHAR_PATTERN.sub(' ', sentence)
+        else:
+            sentence = REMOVABLE_SPECIAL_CHAR_PATTERN.sub(lambda m: REMOVABLE_SPECIAL_CHAR_MAP[m.group(0)], sentence)
+        sentence = SPECIAL_CHAR_PATTERN.sub(lambda m: SPECIAL_CHAR_MAP[m.group(0)], sentence)
     if filter_characters:
         sentence = CHARACTER_FILTER_PATTERN.sub(' ', sentence)
     if filter_urls:
@@ -160,6 +179,9 @@ def run_multiprocessing_job(fn,
         num_processes = multiprocessing.cpu_count()
         logging.info('Auto-detecting number of available cores: {}'.format(num_processes))
 
+    # Every worker must receive at least one element
+    num_processes = min(num_processes, data_size)
+
     chunk_size = data_size // num_processes
 
     q = Queue()
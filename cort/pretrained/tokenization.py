@@ -1,3 +1,5 @@
+import numpy as np
+
 from tqdm import tqdm
 from typing import Union, List, Optional
 
@@ -28,7 +30,8 @@ class TokenizerDelegate:
                  padding: Optional[str] = None,
                  truncation=False,
                  return_attention_mask=True,
-                 return_token_type_ids=True):
+                 return_token_type_ids=True,
+                 return_tensors: Optional[str] = None):
         if isinstance(texts, str):
             texts = [texts]
 
@@ -72,6 +75,10 @@ class TokenizerDelegate:
             return_value['attention_mask'] = dicts['attention_mask']
         if return_token_type_ids:
             return_value['token_type_ids'] = dicts['token_type_ids']
+        if return_tensors == 'np':
+            return_value = {key: np.array(value) for key, value in return_value.items()}
+        elif return_tensors is not None:
+            raise AttributeError('Invalid return_tensors: {}, Allowed: (np)'.format(return_tensors))
         return return_value
 
 
@@ -1,4 +1,5 @@
 import os
+import itertools
 import wandb
 import logging
 import numpy as np
@@ -6,7 +7,7 @@ import pandas as pd
 import tensorflow as tf
 
 from cort.modeling import CortForSequenceClassification, CortForElaboratedSequenceClassification, CortForPretraining
-from cort.optimization import create_optimizer
+from cort.optimization import create_optimizer, compute_learning_rates
 from utils import utils, formatting_utils, dataset_utils
 from tensorflow.keras import metrics
 from tensorflow.keras.utils import Progbar
@@ -15,19 +16,26 @@ from tensorflow_addons import metrics as metrics_tfa
 formatting_utils.setup_formatter()
 
 
-@tf.function
-def train_one_step(model, optimizer, inputs, clip_norm=1.0):
+@tf.function(jit_compile=True, reduce_retracing=True)
+def compute_gradients(model, inputs, clip_norm=1.0):
+    # Forward and backprop are fused by XLA, weight update is kept outside of it
     with tf.GradientTape() as tape:
         loss, cort_outputs = model(inputs, training=True)
     grads = tape.gradient(loss, model.trainable_variables)
 
     (gradients, _) = tf.clip_by_global_norm(grads, clip_norm=clip_norm)
+    return loss, cort_outputs, gradients
+
+
+@tf.function(reduce_retracing=True)
+def train_one_step(model, optimizer, inputs, clip_norm=1.0):
+    loss, cort_outputs, gradients = compute_gradients(model, inputs, clip_norm=clip_norm)
     optimizer.apply_gradients(zip(gradients, model.trainable_variables))
 
     return loss, cort_outputs
 
 
-@tf.function
+@tf.function(jit_compile=True, reduce_retracing=True)
 def eval_one_step(model, inputs):
     return model(inputs, training=False)
 
@@ -93,6 +101,12 @@ def create_metric_map(config):
     return metric_map
 
 
+def create_metric_logs(metric_map):
+    # Fetches all metric results from the device at once
+    values = tf.stack([metric.result() for metric in metric_map.values()]).numpy()
+    return {metric_name: float(value) for metric_name, value in zip(metric_map.keys(), values)}
+
+
 def metric_fn(dicts, cort_outputs, config):
     d = cort_outputs
     confusion_keys = ['accuracy', 'recall', 'precision',
@@ -153,6 +167,7 @@ def main():
     logging.info('Training steps_per_epoch: {}, total_train_steps: {}'.format(steps_per_epoch, total_train_steps))
     with strategy.scope() if config.distribute else utils.empty_context_manager():
         optimizer, learning_rate_fn = create_optimizer(config, total_train_steps)
+        learning_rates = compute_learning_rates(learning_rate_fn, total_train_steps)
         if config.repr_finetune and config.include_sections:
             logging.info('Fine-tuning Representation, Including Sections → Elaborated Representation')
             model = CortForElaboratedSequenceClassification(
@@ -198,6 +213,7 @@ def main():
 
         metric_maps = create_metric_map(config)
         compile_metric_names = ['accuracy', 'recall', 'precision', 'micro_f1_score', 'macro_f1_score']
+        val_metric_names = {metric_name: 'val_' + metric_name for metric_name in metric_maps.keys()}
 
         if config.keep_optimizer_state:
             # Reset optimizer state except required parameters
@@ -215,35 +231,36 @@ def main():
         logging.info('  Batch size = {}'.format(config.batch_size))
         logging.info('  Total training steps = {}'.format(total_train_steps))
 
+        # A single iterator spans all epochs, so the shuffle buffer is filled only once
+        train_iterator = iter(train_dataset)
         num_steps = 0
         for epoch in range(config.initial_epoch, config.epochs):
             print('\nEpoch {}/{}'.format(epoch + 1, config.epochs))
             progbar = Progbar(steps_per_epoch, stateful_metrics=[metric.name for metric in metric_maps.values()])
 
             # Forward and Backprop
-            for step, inputs in enumerate(train_dataset.take(steps_per_epoch)):
+            for step, inputs in enumerate(itertools.islice(train_iterator, steps_per_epoch)):
                 loss, cort_outputs = train_one_step(model, optimizer, inputs)
 
                 # Update metrics with model outputs
                 metric_maps['loss'].update_state(values=loss)
                 metric_fn(metric_maps, cort_outputs, config)
-                progbar.update(step, values=[
-                    (metric_name, float(metric.result().numpy())) for metric_name, metric in metric_maps.items()
-                ])
-                # Reports metrics on W&B
-                wandb.log({
-                    'loss': tf.reduce_mean(loss).numpy(),
-                    'learning_rate': learning_rate_fn(optimizer.iterations)
-                }, step=num_steps)
-                wandb.log({
-                    metric_name: metric.result().numpy() for metric_name, metric in metric_maps.items()
-                }, step=num_steps)
+
+                # Reading metrics blocks on the device, so those are only fetched periodically
+                if step % config.metric_log_freq == 0:
+                    batch_logs = create_metric_logs(metric_maps)
+                    progbar.update(step + 1, values=list(batch_logs.items()))
+
+                    # Reports metrics on W&B at once
+                    batch_logs['learning_rate'] = float(learning_rates[num_steps])
+                    wandb.log(batch_logs, step=num_steps)
+                else:
+                    progbar.update(step + 1)
                 num_steps += 1
 
             # Reset all metric states for evaluation
-            epoch_logs = {}
-            for metric_name, metric in metric_maps.items():
-                epoch_logs[metric_name] = float(metric.result().numpy())
+            epoch_logs = create_metric_logs(metric_maps)
+            for metric in metric_maps.values():
                 metric.reset_state()
 
             # Evaluation
@@ -266,11 +283,11 @@ def main():
                     section_representations.append(cort_outputs['section_representation'].numpy())
                     sections.append(cort_outputs['section_labels'].numpy())
 
-            wandb_logs = {}
-            for metric_name, metric in metric_maps.items():
-                value = float(metric.result().numpy())
-                epoch_logs['val_' + metric_name] = value
-                wandb_logs['val_' + metric_name] = value
+            wandb_logs = {
+                val_metric_names[metric_name]: value for metric_name, value in create_metric_logs(metric_maps).items()
+            }
+            epoch_logs.update(wandb_logs)
+            for metric in metric_maps.values():
                 metric.reset_state()
 
             if len(representations) > 0:
@@ -284,7 +301,7 @@ def main():
 
             progbar.update(
                 current=steps_per_epoch,
-                values=[(name, value) for name, value in epoch_logs.items()],
+                values=list(epoch_logs.items()),
                 finalize=True
             )
             manager.save(checkpoint_number=epoch)
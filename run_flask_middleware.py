@@ -22,8 +22,9 @@ def request_prediction(sentence, tokenizer, replacements, channel, args):
                           padding='max_length',
                           truncation=True,
                           return_attention_mask=False,
-                          return_token_type_ids=False)
-    input_ids = np.array(tokenized['input_ids'], dtype=np.int32)
+                          return_token_type_ids=False,
+                          return_tensors='np')
+    input_ids = tokenized['input_ids'].astype(np.int32, copy=False)
 
     # build gRPC predict request
     predict_req = PredictRequest()
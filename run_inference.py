@@ -244,8 +244,9 @@ def perform_interactive_predictions(config: Config, runner: ModelRunner):
                               padding='max_length',
                               truncation=True,
                               return_attention_mask=False,
-                              return_token_type_ids=False)
-        input_ids = np.array(tokenized['input_ids'], dtype=np.int32)
+                              return_token_type_ids=False,
+                              return_tensors='np')
+        input_ids = tokenized['input_ids'].astype(np.int32, copy=False)
         probs, correlations = runner.call(input_ids, tokenizer)
 
         sequence_length = np.sum(input_ids != tokenizer.pad_token_id)
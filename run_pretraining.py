@@ -7,7 +7,7 @@ import tensorflow as tf
 
 from utils import utils, formatting_utils, dataset_utils
 from cort.modeling import CortForPretraining
-from cort.optimization import GradientAccumulator, create_optimizer
+from cort.optimization import GradientAccumulator, create_optimizer, compute_learning_rates
 from tensorflow.keras import metrics
 
 formatting_utils.setup_formatter()
@@ -54,27 +54,38 @@ def analyze_representation(model, valid_dataset, val_metric, step):
 
 
 @tf.function
-def train_one_step(config, model, optimizer, inputs, accumulator, take_step, clip_norm=1.0):
-    # Forward and backprop
-    with tf.GradientTape() as tape:
-        loss, _ = model(inputs, training=True)
-    grads = tape.gradient(loss, model.trainable_variables)
-
-    # Accumulate gradients
-    accumulator(grads)
-    if take_step:
-        # All reduce and clip the accumulated gradients
-        reduced_accumulated_gradients = [
-            None if g is None else g / tf.cast(config.gradient_accumulation_steps, g.dtype)
-            for g in accumulator.accumulated_gradients
-        ]
-        (clipped_accumulated_gradients, _) = tf.clip_by_global_norm(reduced_accumulated_gradients, clip_norm=clip_norm)
-
-        # Weight update
-        optimizer.apply_gradients(zip(clipped_accumulated_gradients, model.trainable_variables))
-        accumulator.reset()
+def train_one_step(model, optimizer, micro_batches, accumulator, clip_norm=1.0):
+    # Every micro-batch of an effective step is accumulated within a single graph loop
+    num_micro_batches = len(micro_batches)
+    stacked_inputs = tf.nest.map_structure(lambda *tensors: tf.stack(tensors), *micro_batches)
+
+    total_loss = tf.constant(0.0)
+    for i in tf.range(num_micro_batches):
+        # Runs micro-batches one after another, so that activations of only one micro-batch are kept at a time
+        tf.autograph.experimental.set_loop_options(parallel_iterations=1)
+        inputs = tf.nest.map_structure(lambda tensor: tensor[i], stacked_inputs)
+
+        # Forward and backprop
+        with tf.GradientTape() as tape:
+            loss, _ = model(inputs, training=True)
+        grads = tape.gradient(loss, model.trainable_variables)
+
+        # Accumulate gradients
+        accumulator(grads)
+        total_loss += tf.cast(tf.reduce_mean(loss), total_loss.dtype)
+
+    # All reduce and clip the accumulated gradients
+    reduced_accumulated_gradients = [
+        None if g is None else g / tf.cast(num_micro_batches, g.dtype)
+        for g in accumulator.accumulated_gradients
+    ]
+    (clipped_accumulated_gradients, _) = tf.clip_by_global_norm(reduced_accumulated_gradients, clip_norm=clip_norm)
 
-    return loss
+    # Weight update
+    optimizer.apply_gradients(zip(clipped_accumulated_gradients, model.trainable_variables))
+    accumulator.reset()
+
+    return total_loss / num_micro_batches
 
 
 def main():
@@ -98,7 +109,14 @@ def main():
     with strategy.scope() if config.distribute else utils.empty_context_manager():
         model = CortForPretraining(config)
         accumulator = GradientAccumulator()
+
+        # Variables cannot be created within the graph loop of `train_one_step`, so those are built beforehand.
+        # Variables without gradients are kept as `None` in the accumulator, as if accumulated for the first time.
+        with tf.GradientTape() as tape:
+            dummy_loss, _ = model(model.dummy_inputs, training=True)
+        accumulator.build(tape.gradient(dummy_loss, model.trainable_variables))
         optimizer, learning_rate_fn = create_optimizer(config, config.num_train_steps)
+        learning_rates = compute_learning_rates(learning_rate_fn, config.num_train_steps)
         metric = metrics.Mean(name='loss')
         val_metric = metrics.Mean(name='val_loss')
 
@@ -119,22 +137,21 @@ def main():
 
         accumulator.reset()
         start_time = utils.current_milliseconds()
-        num_steps = 0
         while int(checkpoint.step) <= config.num_train_steps:
             step = int(checkpoint.step)
-            inputs = next(train_iterator)
-            take_step = (num_steps == 0) or (step + 1) % config.gradient_accumulation_steps == 0
+            micro_batches = tuple([next(train_iterator) for _ in range(config.gradient_accumulation_steps)])
 
-            loss = train_one_step(config, model, optimizer, inputs, accumulator, take_step)
+            loss = train_one_step(model, optimizer, micro_batches, accumulator)
             metric.update_state(values=loss)
 
-            # Reports metrics on W&B
-            wandb.log({
-                'loss': tf.reduce_mean(loss).numpy(),
-                'learning_rate': learning_rate_fn(step)
-            }, step=step)
+            # Reports metrics on W&B periodically, since reading the loss blocks on the device
+            if step % config.metric_log_freq == 0:
+                wandb.log({
+                    'loss': loss.numpy(),
+                    'learning_rate': float(learning_rates[step])
+                }, step=step)
 
-            if (step % config.log_freq == 0) and (num_steps % config.gradient_accumulation_steps == 0):
+            if step % config.log_freq == 0:
                 minutes, seconds = utils.format_minutes_and_seconds(utils.current_milliseconds() - start_time)
                 logging.info(
                     'Step: {step:6d}, Loss: {loss:10.6f}, Elapsed: {elapsed}'
@@ -152,7 +169,7 @@ def main():
                 )
 
             # Print allreduced metrics on the last step
-            if int(checkpoint.step) == config.num_train_steps and num_steps % config.gradient_accumulation_steps == 0:
+            if step == config.num_train_steps:
                 minutes, seconds = utils.format_minutes_and_seconds(utils.current_milliseconds() - start_time)
                 logging.info(
                     '<FINAL STEP METRICS> Step: {step:6d}, Loss: {loss:10.6f}, Elapsed: {elapsed}'
@@ -160,15 +177,11 @@ def main():
                             elapsed='{:02d}:{:02d}'.format(minutes, seconds))
                 )
 
-            if num_steps % config.gradient_accumulation_steps == 0:
-                checkpoint.step.assign(int(optimizer.iterations))
-
-            if num_steps % (config.save_checkpoint_steps * config.gradient_accumulation_steps) == 0:
+            checkpoint.step.assign(int(optimizer.iterations))
+            if step % config.save_checkpoint_steps == 0:
                 manager.save(checkpoint_number=step)
                 logging.info(' * Saved model checkpoint for step: {}'.format(step))
 
-            num_steps += 1
-
     logging.info('Finishing all jobs')
 
 
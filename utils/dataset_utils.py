@@ -1,13 +1,14 @@
+import os
+import hashlib
 import logging
 import numpy as np
 import tensorflow as tf
 
 from cort.config import Config
-from tensorflow.python.framework import smart_cond
 from sklearn.utils.class_weight import compute_class_weight
 
 
-def parse_tfrecords(config: Config):
+def create_example_parser(config: Config, class_weights=None):
     maxlen = config.pretrained_config.max_position_embeddings
     feature_desc = {
         'input_ids': tf.io.FixedLenFeature([maxlen], tf.int64),
@@ -15,8 +16,9 @@ def parse_tfrecords(config: Config):
         'labels': tf.io.FixedLenFeature([1], tf.int64)
     }
 
-    def _parse_feature_desc(example_proto):
-        example = tf.io.parse_single_example(example_proto, feature_desc)
+    def _parse_feature_desc(example_protos):
+        # Parses the whole batch of serialized examples at once
+        example = tf.io.parse_example(example_protos, feature_desc)
 
         # tf.int64 is acceptable, but tf.int32 has more performance advantages.
         for name in list(example.keys()):
@@ -24,65 +26,104 @@ def parse_tfrecords(config: Config):
             if tensor.dtype == tf.int64:
                 tensor = tf.cast(tensor, tf.int32)
             example[name] = tensor
-        return example
 
-    fname = config.tfrecord_name.format(
+        sections = tf.reshape(example['sections'], (-1,))
+        labels = tf.reshape(example['labels'], (-1,))
+        if class_weights is None:
+            return example['input_ids'], (sections, labels)
+
+        # Looks up sample weights within the parsing map rather than mapping the batch once again
+        cw = tuple([tf.gather(cw_tensor, y) for y, cw_tensor in zip((sections, labels), class_weights)])
+        return example['input_ids'], (sections, labels), cw
+
+    return _parse_feature_desc
+
+
+def format_tfrecord_name(config: Config, scope: str):
+    return config.tfrecord_name.format(
         model_name=config.model_name.replace('/', '_'),
-        scope='{scope}',
+        scope=scope,
         index=config.current_fold + 1,
         fold=config.num_k_fold
     )
-    logging.info('Parsing TFRecords from {}'.format(fname))
-    train_ds = tf.data.TFRecordDataset(fname.format(scope='train')).map(_parse_feature_desc)
-    valid_ds = tf.data.TFRecordDataset(fname.format(scope='valid')).map(_parse_feature_desc)
+
+
+def parse_tfrecords(config: Config):
+    logging.info('Parsing TFRecords from {}'.format(format_tfrecord_name(config, scope='{scope}')))
+    train_ds = tf.data.TFRecordDataset(format_tfrecord_name(config, scope='train'))
+    valid_ds = tf.data.TFRecordDataset(format_tfrecord_name(config, scope='valid'))
     return train_ds, valid_ds
 
 
+def create_dataset_options(config: Config):
+    options = tf.data.Options()
+
+    # Static graph rewrites fusing and parallelizing the input pipeline
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.map_parallelization = True
+    options.experimental_optimization.parallel_batch = True
+    options.experimental_optimization.shuffle_and_repeat_fusion = True
+    options.experimental_optimization.noop_elimination = True
+
+    # Delays the terminal prefetch slightly so that batches land right after the previous step finishes
+    options.experimental_slack = True
+
+    # MirroredStrategy runs the input pipeline once on the host and splits every global batch across replicas,
+    # so the preprocessing is never duplicated per replica. Each fold is a single TFRecord file, therefore only
+    # DATA sharding is possible once the pipeline is spread over multiple workers.
+    if config.distribute:
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    return options
+
+
+def cache_dataset(config: Config, dataset: tf.data.Dataset, scope: str):
+    if not config.enable_dataset_cache:
+        return dataset
+
+    if config.dataset_cache_dir:
+        # Cache files hold batched and parsed tensors. Those are keyed by everything that shapes them,
+        # including the source TFRecord and its modification, so that a stale cache is never reused silently.
+        # Files are accessed through TF filesystems, as TFRecords and caches may be located at remote storages.
+        tfrecord_name = format_tfrecord_name(config, scope=scope)
+        tfrecord_stat = tf.io.gfile.stat(tfrecord_name)
+        tfrecord_path = tfrecord_name if '://' in tfrecord_name else os.path.abspath(tfrecord_name)
+        source_key = '{}:{}:{}'.format(tfrecord_path, tfrecord_stat.length, tfrecord_stat.mtime_nsec)
+        fname = '{model_name}.{scope}.fold-{index}-of-{fold}.batch-{batch_size}.maxlen-{maxlen}.{source}'.format(
+            model_name=config.model_name.replace('/', '_'),
+            scope=scope,
+            index=config.current_fold + 1,
+            fold=config.num_k_fold,
+            batch_size=config.batch_size,
+            maxlen=config.pretrained_config.max_position_embeddings,
+            source=hashlib.md5(source_key.encode('utf-8')).hexdigest()[:12]
+        )
+        tf.io.gfile.makedirs(config.dataset_cache_dir)
+        return dataset.cache(os.path.join(config.dataset_cache_dir, fname))
+    return dataset.cache()
+
+
 def configure_tensorflow_dataset(config: Config,
                                  strategy: tf.distribute.MirroredStrategy,
                                  add_steps_per_epoch=False,
                                  add_class_weight=False):
-    def _reshape_and_splits_example(example):
-        sections = tf.reshape(example['sections'], (-1,))
-        labels = tf.reshape(example['labels'], (-1,))
-        return example['input_ids'], (sections, labels)
-
-    def _class_weight_map_fn(cw_tuple):
-        def _calc_cw(cw):
-            class_ids = list(sorted(cw.keys()))
-            expected_class_ids = list(range(len(class_ids)))
-            if class_ids != expected_class_ids:
-                raise ValueError(
-                    'Expected `class_weight` to be a dict with keys from 0 to one less'
-                    'than the number of classes, found {}'.format(cw)
-                )
-            return tf.convert_to_tensor([cw[int(c)] for c in class_ids])
-
-        cw_tensors = [_calc_cw(cw_proto) for cw_proto in cw_tuple]
-
-        @tf.function
-        def _rearrange_cw(y_true, cw_tensor):
-            y_classes = smart_cond.smart_cond(
-                y_true.shape.rank == 2 and tf.shape(y_true)[1] > 1,
-                lambda: tf.argmax(y_true, axis=1),
-                lambda: tf.cast(tf.reshape(y_true, (-1,)), dtype=tf.int32)
+    def _calc_cw(cw):
+        class_ids = list(sorted(cw.keys()))
+        expected_class_ids = list(range(len(class_ids)))
+        if class_ids != expected_class_ids:
+            raise ValueError(
+                'Expected `class_weight` to be a dict with keys from 0 to one less'
+                'than the number of classes, found {}'.format(cw)
             )
-            return tf.gather(cw_tensor, y_classes)
-
-        @tf.function
-        def _map_fn(input_ids, y_tuple):
-            cw = tuple([_rearrange_cw(y_true, cw_tensor) for y_true, cw_tensor in zip(y_tuple, cw_tensors)])
-            return input_ids, y_tuple, cw
-
-        return _map_fn
+        return tf.convert_to_tensor([cw[int(c)] for c in class_ids])
 
+    parse_fn = create_example_parser(config)
     train_dataset, valid_dataset = parse_tfrecords(config)
-    train_dataset = train_dataset.prefetch(buffer_size=tf.data.AUTOTUNE).batch(config.batch_size, drop_remainder=True)
-    train_dataset = train_dataset.map(_reshape_and_splits_example)
+    labels_dataset = train_dataset.batch(config.batch_size, drop_remainder=True)
+    labels_dataset = labels_dataset.map(parse_fn, num_parallel_calls=tf.data.AUTOTUNE)
 
     steps_per_epoch = 0
     train_labels = None
-    for x, ys in train_dataset:
+    for x, ys in labels_dataset:
         if train_labels is None:
             train_labels = [[] for _ in range(len(ys))]
 
@@ -98,18 +139,28 @@ def configure_tensorflow_dataset(config: Config,
         class_weight = dict(enumerate(class_weight))
         class_weights += (class_weight,)
 
+    # Shuffles examples rather than batches. The training loops keep a single iterator over the repeated
+    # dataset, so the shuffle and repeat fuse and the buffer is not refilled at every epoch.
+    train_dataset = train_dataset.shuffle(buffer_size=config.shuffle_buffer_size, reshuffle_each_iteration=True)
+    train_dataset = train_dataset.repeat().batch(config.batch_size, drop_remainder=True)
     if add_class_weight:
-        train_dataset = train_dataset.map(_class_weight_map_fn(class_weights))
+        train_parse_fn = create_example_parser(config, class_weights=[_calc_cw(cw) for cw in class_weights])
+    else:
+        train_parse_fn = parse_fn
+    train_dataset = train_dataset.map(train_parse_fn, num_parallel_calls=tf.data.AUTOTUNE)
+    train_dataset = train_dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
 
-    train_dataset = train_dataset.shuffle(buffer_size=1024).repeat()
-    valid_dataset = valid_dataset.batch(config.batch_size).map(_reshape_and_splits_example)
+    valid_dataset = valid_dataset.batch(config.batch_size).map(parse_fn, num_parallel_calls=tf.data.AUTOTUNE)
+    valid_dataset = cache_dataset(config, valid_dataset, scope='valid')
+    valid_dataset = valid_dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
 
-    if config.distribute:
-        options = tf.data.Options()
-        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    options = create_dataset_options(config)
+    train_dataset = train_dataset.with_options(options)
+    valid_dataset = valid_dataset.with_options(options)
 
-        train_dataset = strategy.experimental_distribute_dataset(train_dataset.with_options(options))
-        valid_dataset = strategy.experimental_distribute_dataset(valid_dataset.with_options(options))
+    if config.distribute:
+        train_dataset = strategy.experimental_distribute_dataset(train_dataset)
+        valid_dataset = strategy.experimental_distribute_dataset(valid_dataset)
 
     ds = (train_dataset, valid_dataset)
     if add_steps_per_epoch:
@@ -52,7 +52,7 @@ def create_tokenizer_from_config(config):
     elif config.model_name == 'korscielectra':
         tokenizer = tokenization.create_tokenizer(config.korscielectra_vocab, tokenizer_type='electra')
     else:
-        tokenizer = AutoTokenizer.from_pretrained(config.model_name)
+        tokenizer = AutoTokenizer.from_pretrained(config.model_name, use_fast=True)
     return tokenizer
 
 